@@ -5,15 +5,21 @@ Main schedule
 from __future__ import annotations
 import logging
 import os
-import traceback
-from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+import sys
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
+from project import bulk
 from project.models import Session
-from project.sources import reddit
+from project.sources import comments, dump, reddit
+from project.transforms import coalesce
+from project.transforms.coalesce import coalesce_by_hash, coalesce_by_url
 from project.transforms.language import extract_nltk_features
-from project.transforms.vision import extract_image_features
+from project.transforms.vision import extract_image_batch_features, extract_image_features
 
 import prefect
+from prefect.executors import LocalDaskExecutor
+from prefect.triggers import always_run
+from sqlalchemy.exc import IntegrityError
 
 if TYPE_CHECKING:
     from project.result import Result
@@ -33,6 +39,33 @@ def get_reddit_rising(limit: int) -> list:
 def get_reddit_top(limit: int) -> list:
     return list(reddit.TopSource(limit=limit).extract())
 
+@prefect.task
+def shard_reddit_dumps(paths: List[str], shards: int) -> List[Tuple[str, int, Optional[int]]]:
+    return [(p, start, end) for p in paths for start, end in dump.shard_offsets(p, shards)]
+
+@prefect.task
+def get_reddit_comments(results: List[Result], limit: int, depth: int) -> List[Result]:
+    if limit <= 0:
+        return results
+    fetcher = comments.CommentFetcher(
+        limit=limit,
+        depth=depth,
+        requests_per_minute=float(os.getenv('REDDIT_REQUESTS_PER_MINUTE', 60)),
+        workers=int(os.getenv('REDDIT_COMMENT_WORKERS', 4)),
+        api_url=os.getenv('REDDIT_API_URL', comments.REDDIT_API_URL),
+        auth_url=os.getenv('REDDIT_AUTH_URL', comments.REDDIT_AUTH_URL)
+    )
+    # dead images are dropped before spending requests on them
+    return comments.attach_comments([r for r in results if r.is_db_ready], fetcher)
+
+@prefect.task
+def url_coalesce(results: List[List[Result]]) -> List[Result]:
+    return coalesce_by_url([r for rs in results for r in rs])
+
+@prefect.task
+def hash_coalesce(results: List[Result]) -> List[Result]:
+    return coalesce_by_hash(results)
+
 @prefect.task
 def nltk_transform(results: List[Result]) -> List[Result]:
     for r in results:
@@ -41,46 +74,132 @@ def nltk_transform(results: List[Result]) -> List[Result]:
 
 @prefect.task
 def cv2_transform(results: List[Result]) -> List[Result]:
+    ready, thumbnails = [], []
     for r in results:
-        extract_image_features(r)
+        thumbnail = extract_image_features(r)
+        if thumbnail is not None:
+            ready.append(r)
+            thumbnails.append(thumbnail)
+    extract_image_batch_features(ready, thumbnails)
     return results
 
+def upsert_meme(s: _Session, r: Result):
+    """Inserts a result's meme, or attaches its texts to the stored meme if it exists."""
+    try:
+        if r.is_existing:
+            for mtext in r.meme.texts:
+                mtext.meme_id = r.meme.id
+                s.add(mtext)
+        else:
+            s.add(r.meme)
+        s.commit()
+    except IntegrityError:
+        s.rollback()
+        if r.is_existing:
+            raise
+        # the meme, its url or its post was stored by a concurrent load since the
+        # result was coalesced
+        stored_id = coalesce.stored_meme_ids(s, [r])[0]
+        if stored_id is None:
+            raise
+        if coalesce.attach_to_stored(r, stored_id, coalesce.stored_text_keys(s, [stored_id])):
+            upsert_meme(s, r)
+
 @prefect.task
-def db_load(results: List[Result], dependents: Optional[Tuple[Any]] = None):
-    with Session() as s:
+def db_load(results: List[Result], bulk_load: bool = False):
+    with (bulk.bulk_session() if bulk_load else Session()) as s:
         s: _Session
-        to_save = map(
-            lambda r: r.meme, 
-            filter(lambda r: r.is_db_ready, results)
-        )
         loaded = 0
-        for meme in to_save:
+        for r in filter(lambda r: r.is_db_ready, results):
             try:
-                s.add(meme)
-                s.commit()
+                upsert_meme(s, r)
                 loaded += 1
             except Exception:
-                logging.error(f"Errored while inserting {meme}\n{traceback.format_exc()}")
-        logging.info(f"loaded {loaded} / {len(results)}")
+                s.rollback()
+                logging.error("Errored while inserting %s", r.meme, exc_info=True)
+        logging.info("loaded %d / %d", loaded, len(results))
+
+@prefect.task
+def create_partitions():
+    bulk.create_current_partitions()
+
+@prefect.task
+def begin_bulk_load(bulk_load: bool) -> list:
+    return bulk.drop_secondary_indexes() if bulk_load else []
+
+@prefect.task(trigger=always_run)
+def end_bulk_load(indexes: list):
+    bulk.rebuild_indexes(indexes)
+
+@prefect.task
+def backfill_reddit_dump(shard: Tuple[str, int, Optional[int]], batch_size: int, bulk_load: bool = False):
+    # streams the shard through the transforms in fixed-size batches so memory
+    # stays bounded regardless of the dump's size
+    path, start, end = shard
+    source = dump.RedditDumpSource(path, start=start, end=end)
+    batch: List[Result] = []
+    for r in source.extract():
+        batch.append(r)
+        if len(batch) >= batch_size:
+            process_batch(batch, bulk_load)
+            batch = []
+    if batch:
+        process_batch(batch, bulk_load)
+
+def process_batch(results: List[Result], bulk_load: bool = False):
+    results = url_coalesce.run([results])
+    results = cv2_transform.run(results)
+    results = hash_coalesce.run(results)
+    results = nltk_transform.run(results)
+    db_load.run(results, bulk_load)
 
 with prefect.Flow('test') as flow:
     reddit_limit = prefect.Parameter('reddit_limit', int(os.getenv('REDDIT_QUERY_SIZE', 100)))
+    # top comments ingested per post, 0 disables comment ingestion
+    reddit_comment_limit = prefect.Parameter('reddit_comment_limit', int(os.getenv('REDDIT_COMMENT_LIMIT', 0)))
+    reddit_comment_depth = prefect.Parameter('reddit_comment_depth', int(os.getenv('REDDIT_COMMENT_DEPTH', 1)))
 
     r_hot_0 = get_reddit_hot(reddit_limit)
-    r_hot_1_a = nltk_transform(r_hot_0)
-    r_hot_1_b = cv2_transform(r_hot_0)
-    db_load(r_hot_0, dependents=(r_hot_1_a, r_hot_1_b))
-
     r_rising_0 = get_reddit_rising(reddit_limit)
-    r_rising_1_a = nltk_transform(r_rising_0)
-    r_rising_1_b = cv2_transform(r_rising_0)
-    db_load(r_rising_0, dependents=(r_rising_1_a, r_rising_1_b))
-
     r_top_0 = get_reddit_top(reddit_limit)
-    r_top_1_a = nltk_transform(r_top_0)
-    r_top_1_b = cv2_transform(r_top_0)
-    db_load(r_top_0, dependents=(r_top_1_a, r_top_1_b))
+
+    # listings overlap, so they are coalesced and transformed as one batch
+    r_1 = url_coalesce([r_hot_0, r_rising_0, r_top_0])
+    r_2 = cv2_transform(r_1)
+    r_3 = get_reddit_comments(r_2, reddit_comment_limit, reddit_comment_depth)
+    r_4 = hash_coalesce(r_3)
+    r_5 = nltk_transform(r_4)
+    partitions = create_partitions()
+    db_load(r_5, upstream_tasks=[partitions])
+
+with prefect.Flow('backfill') as backfill_flow:
+    dump_paths = prefect.Parameter('dump_paths', [])
+    dump_shards = prefect.Parameter('dump_shards', int(os.getenv('DUMP_SHARDS', 1)))
+    dump_batch_size = prefect.Parameter('dump_batch_size', int(os.getenv('DUMP_BATCH_SIZE', 500)))
+    # defer secondary indexes and foreign key checks until the backfill is loaded
+    dump_bulk_load = prefect.Parameter('dump_bulk_load', os.getenv('DUMP_BULK_LOAD', '').lower() in ('1', 'true', 'yes'))
+
+    dump_0 = shard_reddit_dumps(dump_paths, dump_shards)
+    dump_partitions = create_partitions()
+    dump_indexes = begin_bulk_load(dump_bulk_load, upstream_tasks=[dump_partitions])
+    dump_1 = backfill_reddit_dump.map(
+        dump_0,
+        batch_size=prefect.unmapped(dump_batch_size),
+        bulk_load=prefect.unmapped(dump_bulk_load),
+        upstream_tasks=[prefect.unmapped(dump_indexes)]
+    )
+    end_bulk_load(dump_indexes, upstream_tasks=[dump_1])
+
+# mapped shards run concurrently. Threads rather than processes, so the database
+# engine and logging listeners aren't inherited across a fork
+backfill_flow.executor = LocalDaskExecutor(
+    scheduler='threads',
+    num_workers=int(os.getenv('DUMP_WORKERS', os.getenv('DUMP_SHARDS', 1)))
+)
 
 
 if __name__ == '__main__':
-    flow.run({'reddit_limit': 5})
+    if len(sys.argv) > 1:
+        backfill_flow.run({'dump_paths': sys.argv[1:]})
+    else:
+        flow.run({'reddit_limit': 5})
@@ -0,0 +1,239 @@
+"""
+Bulk ingest utilities for large backfills.
+
+Index maintenance dominates insert time on the text and token tables. During a
+backfill their secondary indexes are dropped, rows are loaded with foreign key
+checks disabled, and the indexes are rebuilt once at the end.
+
+```python
+with deferred_indexes(), bulk_session() as s:
+    ...
+```
+"""
+from __future__ import annotations
+import logging
+from contextlib import contextmanager
+from datetime import date
+from typing import Iterable, Iterator, List, TYPE_CHECKING
+
+from project import models as m
+
+from sqlalchemy import Index, Table, event
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Connection
+    from sqlalchemy.orm.session import Session as _Session, SessionTransaction
+
+logger = logging.getLogger(__name__)
+
+BULK_TABLES = (
+    m.MemeText.__table__,
+    m.MemeSentence.__table__,
+    m.MemeChunk.__table__,
+    m.MemeWord.__table__,
+)
+PARTITIONED_TABLES = (
+    m.MemeChunk.__table__,
+    m.MemeWord.__table__,
+)
+# the load path reads through these, see `coalesce_by_hash`
+KEEP_COLUMNS = {m.MemeText.__table__.c.meme_id}
+
+
+def is_partitioned(table: Table) -> bool:
+    return bool(table.dialect_options['postgresql']['partition_by'])
+
+def secondary_indexes(tables: Iterable[Table] = BULK_TABLES) -> List[Index]:
+    """Lists the non-primary-key indexes of the tables that can be deferred.
+
+    :param tables: Tables to list indexes of, defaults to `BULK_TABLES`
+    :type tables: Iterable[Table], optional
+    :return: Indexes
+    :rtype: List[Index]
+    """
+    return [
+        idx for t in tables for idx in sorted(t.indexes, key=lambda i: i.name)
+        if not KEEP_COLUMNS.intersection(idx.columns)
+    ]
+
+def drop_secondary_indexes(tables: Iterable[Table] = BULK_TABLES) -> List[Index]:
+    """Drops the deferrable secondary indexes of the tables.
+
+    :param tables: Tables to drop indexes of, defaults to `BULK_TABLES`
+    :type tables: Iterable[Table], optional
+    :return: The dropped indexes, to pass to `rebuild_indexes`
+    :rtype: List[Index]
+    """
+    indexes = secondary_indexes(tables)
+    with m.engine.begin() as conn:
+        for idx in indexes:
+            idx.drop(conn, checkfirst=True)
+            logger.info("Dropped index %s", idx.name)
+    return indexes
+
+def drop_invalid_index(conn: Connection, idx: Index) -> bool:
+    """Drops an index left INVALID by a failed concurrent build.
+
+    Such an index still exists under its name, so `checkfirst` would skip rebuilding it.
+
+    :param conn: Autocommit connection
+    :type conn: Connection
+    :param idx: Index to check
+    :type idx: Index
+    :return: An invalid index was dropped
+    :rtype: bool
+    """
+    invalid = conn.exec_driver_sql(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %(name)s",
+        {'name': idx.name}
+    ).scalar()
+    if invalid:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {idx.name}")
+        logger.warning("Dropped invalid index %s", idx.name)
+    return bool(invalid)
+
+def rebuild_indexes(indexes: Iterable[Index], retries: int = 1):
+    """Recreates indexes without blocking writes to their tables.
+
+    Postgres cannot build an index concurrently on a partitioned table, so those are
+    built with a plain `CREATE INDEX`, which cascades to every partition.
+
+    A failed concurrent build leaves an INVALID index behind. It is dropped and the
+    build retried. Indexes that still fail once the retries are spent are skipped so the
+    rest are rebuilt, and are raised together at the end.
+
+    :param indexes: Indexes to recreate
+    :type indexes: Iterable[Index]
+    :param retries: Rebuild attempts per index after a failure, defaults to 1
+    :type retries: int, optional
+    :raises RuntimeError: Listing the indexes that could not be rebuilt
+    """
+    failed: List[str] = []
+    with m.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn: Connection
+        for idx in indexes:
+            concurrently = not is_partitioned(idx.table)
+            drop_invalid_index(conn, idx)
+            for attempt in range(retries + 1):
+                idx.dialect_kwargs['postgresql_concurrently'] = concurrently
+                try:
+                    idx.create(conn, checkfirst=True)
+                    logger.info("Rebuilt index %s%s", idx.name, " concurrently" if concurrently else "")
+                    break
+                except Exception:
+                    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {idx.name}")
+                    if attempt == retries:
+                        logger.error("Failed to rebuild index %s", idx.name, exc_info=True)
+                        failed.append(idx.name)
+                    else:
+                        logger.warning("Retrying build of index %s", idx.name, exc_info=True)
+                finally:
+                    idx.dialect_kwargs['postgresql_concurrently'] = False
+    if failed:
+        raise RuntimeError(f"Failed to rebuild indexes {', '.join(failed)}")
+
+@contextmanager
+def deferred_indexes(tables: Iterable[Table] = BULK_TABLES) -> Iterator[List[Index]]:
+    """Drops the tables' secondary indexes for the duration of the block and rebuilds
+    them afterwards, even if the block fails.
+
+    :param tables: Tables to defer indexes of, defaults to `BULK_TABLES`
+    :type tables: Iterable[Table], optional
+    :yield: The dropped indexes
+    :rtype: Iterator[List[Index]]
+    """
+    indexes = drop_secondary_indexes(tables)
+    try:
+        yield indexes
+    finally:
+        rebuild_indexes(indexes)
+
+
+def _disable_fk_checks(session: _Session, transaction: SessionTransaction, connection: Connection):
+    # foreign keys are enforced by triggers, which replica mode skips
+    connection.exec_driver_sql("SET LOCAL session_replication_role = replica")
+
+@contextmanager
+def bulk_session(disable_fk_checks: bool = True) -> Iterator[_Session]:
+    """Session for bulk loading with foreign key checks disabled in each transaction.
+
+    Rows are trusted to reference existing parents, as they do when loaded through the
+    ORM. Changing `session_replication_role` requires a superuser.
+
+    :param disable_fk_checks: Skip foreign key checks, defaults to True
+    :type disable_fk_checks: bool, optional
+    :yield: Database session
+    :rtype: Iterator[Session]
+    """
+    with m.Session() as s:
+        if disable_fk_checks:
+            event.listen(s, 'after_begin', _disable_fk_checks)
+        yield s
+
+
+def month_partition_name(table: Table, month: date) -> str:
+    return f"{table.name}_{month.year}_{month.month:02d}"
+
+def create_month_partitions(start: date, months: int, tables: Iterable[Table] = PARTITIONED_TABLES):
+    """Creates monthly partitions of the token tables.
+
+    Partitions must be created before rows for their month arrive, since Postgres
+    refuses to add a partition whose range already has rows in the default partition.
+
+    :param start: Any day in the first month
+    :type start: date
+    :param months: Number of consecutive months to create
+    :type months: int
+    :param tables: Partitioned tables, defaults to `PARTITIONED_TABLES`
+    :type tables: Iterable[Table], optional
+    """
+    with m.engine.begin() as conn:
+        for table in tables:
+            if not is_partitioned(table):
+                raise ValueError(f"{table.name} is not partitioned, set PARTITION_TOKEN_TABLES before creating it")
+            month = start.replace(day=1)
+            for _ in range(months):
+                following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+                conn.exec_driver_sql(
+                    f"CREATE TABLE IF NOT EXISTS {month_partition_name(table, month)} "
+                    f"PARTITION OF {table.name} FOR VALUES FROM ('{month}') TO ('{following}')"
+                )
+                month = following
+
+def create_current_partitions(months: int = 2, tables: Iterable[Table] = PARTITIONED_TABLES):
+    """Creates the partitions for the database's current month and the months after it.
+
+    Meant to run before each load, so rows never land in the default partition of a
+    month that could still get its own partition. Does nothing if the token tables
+    aren't partitioned.
+
+    :param months: Number of months to create starting from the current one, defaults to 2
+    :type months: int, optional
+    :param tables: Partitioned tables, defaults to `PARTITIONED_TABLES`
+    :type tables: Iterable[Table], optional
+    """
+    tables = [t for t in tables if is_partitioned(t)]
+    if not tables:
+        return
+    # created_at defaults to the database's clock, which may disagree with ours
+    with m.engine.connect() as conn:
+        today: date = conn.exec_driver_sql("SELECT CAST(now() AS date)").scalar()
+    create_month_partitions(today, months, tables)
+
+def detach_month_partition(month: date, tables: Iterable[Table] = PARTITIONED_TABLES):
+    """Detaches a month's partitions from the token tables.
+
+    The detached tables keep their rows and can be archived or dropped without
+    touching the rest of the data.
+
+    :param month: Any day in the month
+    :type month: date
+    :param tables: Partitioned tables, defaults to `PARTITIONED_TABLES`
+    :type tables: Iterable[Table], optional
+    """
+    with m.engine.begin() as conn:
+        for table in tables:
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table.name} DETACH PARTITION {month_partition_name(table, month)}"
+            )
@@ -0,0 +1,239 @@
+"""
+Dataset export.
+
+Streams the meme graph out of the database into sharded JSONL files and a
+memory-mapped matrix of image hashes.
+
+    python -m project.export OUT_DIR [--shard-size N] [--batch-size N]
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from project import models as m
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import selectinload
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Query
+    from sqlalchemy.sql.elements import ColumnElement
+    from sqlalchemy.orm.session import Session as _Session
+
+logger = logging.getLogger(__name__)
+
+HASH_BYTES = 8
+# keyset position of the last exported meme, (created_at, id)
+Cursor = Tuple[datetime, bytes]
+
+
+def exportable(after: Optional[Cursor] = None) -> List[ColumnElement]:
+    """Filter criteria for the memes an export covers, shared by the row count and the
+    pages so they agree.
+
+    Memes without `created_at` have no keyset position and are left out.
+
+    :param after: Keyset cursor to resume after, defaults to None
+    :type after: Cursor, optional
+    :return: Filter criteria
+    :rtype: List[ColumnElement]
+    """
+    criteria = [m.Meme.created_at.isnot(None)]
+    if after is not None:
+        criteria.append(tuple_(m.Meme.created_at, m.Meme.id) > tuple_(*after))
+    return criteria
+
+
+def meme_query(session: _Session, after: Optional[Cursor] = None) -> Query:
+    """Builds the export query for memes, ordered by `(created_at, id)`.
+
+    Every relationship the export touches is batch-loaded with `selectinload`, so each
+    batch of memes costs one query per relationship instead of one per meme. Pages are
+    read off `ix_meme_created_at_id` instead of sorting the table.
+
+    :param session: Database session
+    :type session: Session
+    :param after: Keyset cursor to resume after, defaults to None
+    :type after: Cursor, optional
+    :return: Meme query
+    :rtype: Query
+    """
+    q = session.query(m.Meme).options(
+        selectinload(m.Meme.image),
+        selectinload(m.Meme.context),
+        selectinload(m.Meme.texts)
+            .selectinload(m.MemeText.sentences)
+            .options(
+                selectinload(m.MemeSentence.words),
+                selectinload(m.MemeSentence.chunks)
+            )
+    )
+    return q.filter(*exportable(after)).order_by(m.Meme.created_at, m.Meme.id)
+
+
+def iter_memes(session: _Session, after: Optional[Cursor] = None, page_size: int = 10000, batch_size: int = 500) -> Iterator[m.Meme]:
+    """Streams memes with their full graph loaded.
+
+    Pages are fetched by keyset pagination on `(created_at, id)` and each page is read
+    through a server-side cursor `batch_size` rows at a time. The session is cleared
+    between pages so memory stays bounded.
+
+    :param session: Database session
+    :type session: Session
+    :param after: Keyset cursor to resume after, defaults to None
+    :type after: Cursor, optional
+    :param page_size: Memes per keyset page, defaults to 10000
+    :type page_size: int, optional
+    :param batch_size: Memes fetched per round trip, defaults to 500
+    :type batch_size: int, optional
+    :yield: Meme
+    :rtype: Iterator[Meme]
+    """
+    while True:
+        fetched = 0
+        for meme in meme_query(session, after).limit(page_size).yield_per(batch_size):
+            fetched += 1
+            after = (meme.created_at, meme.id)
+            yield meme
+        session.expunge_all()
+        if fetched < page_size:
+            return
+
+
+def serialize_meme(meme: m.Meme) -> dict:
+    """Converts a meme and its loaded graph into a JSON-serializable dictionary.
+
+    :param meme: Meme with relationships loaded
+    :type meme: Meme
+    :return: Nested meme record
+    :rtype: dict
+    """
+    def columns(obj: Any, *exclude: str) -> Optional[dict]:
+        if obj is None:
+            return None
+        return {
+            c.key: getattr(obj, c.key)
+            for c in obj.__table__.columns
+            if c.key not in exclude
+        }
+
+    return {
+        'id': meme.id.hex(),
+        'url': meme.url,
+        'created_at': meme.created_at,
+        'image': columns(meme.image, 'id'),
+        'context': columns(meme.context, 'id'),
+        'texts': [
+            {
+                'body': mtext.body,
+                'text_type': mtext.text_type,
+                'confidence': mtext.confidence,
+                'sentences': [
+                    {
+                        'sentence': msentence.sentence,
+                        'words': [columns(w, 'id', 'sentence_id', 'created_at') for w in msentence.words],
+                        'chunks': [columns(c, 'id', 'sentence_id', 'created_at') for c in msentence.chunks],
+                    }
+                    for msentence in mtext.sentences
+                ]
+            }
+            for mtext in meme.texts
+        ]
+    }
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, (bytes, memoryview)):
+        return bytes(obj).hex()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def export_dataset(out_dir: str, shard_size: int = 100000, after: Optional[Cursor] = None, page_size: int = 10000, batch_size: int = 500) -> dict:
+    """Exports memes to sharded JSONL files and a memory-mapped hash matrix.
+
+    Files written to `out_dir`
+
+    :memes-NNNNN.jsonl: One meme per line, `shard_size` lines per shard. `row` indexes into the hash matrix
+
+    :hashes.npy:        `(rows, 8)` uint8 matrix of meme id hashes, openable with `np.load(..., mmap_mode='r')`
+
+    :manifest.json:     Row count, shard names and the keyset cursor to resume from
+
+    :param out_dir: Output directory
+    :type out_dir: str
+    :param shard_size: Memes per JSONL shard, defaults to 100000
+    :type shard_size: int, optional
+    :param after: Keyset cursor to resume after, defaults to None
+    :type after: Cursor, optional
+    :param page_size: Memes per keyset page, defaults to 10000
+    :type page_size: int, optional
+    :param batch_size: Memes fetched per round trip, defaults to 500
+    :type batch_size: int, optional
+    :return: The manifest
+    :rtype: dict
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with m.Session() as s:
+        s: _Session
+        capacity: int = s.query(func.count(m.Meme.id)).filter(*exportable(after)).scalar()
+        hashes = open_memmap(os.path.join(out_dir, 'hashes.npy'), mode='w+', dtype=np.uint8, shape=(capacity, HASH_BYTES))
+
+        shards = []
+        rows = 0
+        fo = None
+        try:
+            for meme in iter_memes(s, after, page_size, batch_size):
+                # memes inserted after the count are left for the next export
+                if rows >= capacity:
+                    break
+                if rows % shard_size == 0:
+                    if fo is not None:
+                        fo.close()
+                    shards.append(f"memes-{len(shards):05d}.jsonl")
+                    fo = open(os.path.join(out_dir, shards[-1]), 'w')
+
+                record = serialize_meme(meme)
+                record['row'] = rows
+                fo.write(json.dumps(record, default=_json_default))
+                fo.write('\n')
+                hashes[rows] = np.frombuffer(meme.id.ljust(HASH_BYTES, b'\0')[:HASH_BYTES], dtype=np.uint8)
+                after = (meme.created_at, meme.id)
+                rows += 1
+        finally:
+            if fo is not None:
+                fo.close()
+            hashes.flush()
+            del hashes
+
+    manifest = {
+        'rows': rows,
+        'shards': shards,
+        'hashes': 'hashes.npy',
+        'after': [after[0].isoformat(), after[1].hex()] if after is not None else None
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as fo:
+        json.dump(manifest, fo, indent=2)
+    logger.info("exported %d memes into %d shards", rows, len(shards))
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('out_dir')
+    parser.add_argument('--shard-size', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--after-created-at', type=datetime.fromisoformat, help="Resume cursor timestamp from a previous manifest")
+    parser.add_argument('--after-id', type=bytes.fromhex, help="Resume cursor id from a previous manifest")
+    args = parser.parse_args()
+
+    cursor = (args.after_created_at, args.after_id) if args.after_created_at and args.after_id else None
+    export_dataset(args.out_dir, args.shard_size, cursor, args.page_size, args.batch_size)
@@ -1,9 +1,30 @@
 """
 Logging initialization
+
+When the configuration has a `queue` section with `enabled: true`, every configured
+logger's handlers are moved behind a `QueueHandler`. Callers only enqueue records;
+formatting and I/O happen on a `QueueListener` thread. Repeated warnings and errors
+from the same call site are rate-limited and then sampled so failure storms don't flood
+the queue. Records below WARNING are never sampled.
+
+```yaml
+queue:
+    enabled: true
+    burst: 10           # warnings/errors let through per call site per interval
+    interval: 60        # seconds
+    sample_rate: 100    # 1 in N warnings/errors let through once the burst is spent
+```
 """
+import atexit
+import copy
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
 import yaml
 
@@ -21,4 +42,123 @@ except OSError as e:
     ...
     exit(1)
 
+
+class CallSiteSampler:
+    """Rate-limits records per call site, then samples the overflow.
+
+    The first `burst` records from a call site in each `interval` pass. After that only
+    every `sample_rate`th record passes.
+
+    :param burst: Records let through per call site per interval, defaults to 10
+    :type burst: int, optional
+    :param interval: Length of a rate-limiting window in seconds, defaults to 60
+    :type interval: float, optional
+    :param sample_rate: Let 1 in this many records through once the burst is spent, defaults to 100
+    :type sample_rate: int, optional
+    """
+
+    def __init__(self, burst: int = 10, interval: float = 60, sample_rate: int = 100) -> None:
+        self.burst = burst
+        self.interval = interval
+        self.sample_rate = max(sample_rate, 1)
+        # call site -> [window start, records seen in window, suppressed since last pass]
+        self._sites: Dict[Tuple[str, int], List] = {}
+        self._lock = threading.Lock()
+
+    def sample(self, record: logging.LogRecord) -> Optional[int]:
+        """Decides whether a record passes.
+
+        :param record: Log record
+        :type record: logging.LogRecord
+        :return: None if the record is dropped, otherwise the number of records from its call site suppressed since the last one that passed
+        :rtype: Optional[int]
+        """
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get((record.pathname, record.lineno))
+            if site is None or now - site[0] >= self.interval:
+                site = self._sites[(record.pathname, record.lineno)] = [now, 0, 0]
+            site[1] += 1
+            if site[1] <= self.burst:
+                return 0
+            if (site[1] - self.burst) % self.sample_rate:
+                site[2] += 1
+                return None
+            suppressed, site[2] = site[2], 0
+            return suppressed
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that enqueues records unformatted.
+
+    The stock handler formats the message and traceback on the calling thread. Records
+    never leave the process here, so the listener's handlers can format them instead.
+
+    Warnings and errors are sampled per call site if a sampler is given. Lower levels
+    always pass.
+
+    :param queue: Queue the listener reads from
+    :type queue: queue.SimpleQueue
+    :param sampler: Sampler for warnings and errors, defaults to None
+    :type sampler: CallSiteSampler, optional
+    """
+
+    def __init__(self, queue: queue.SimpleQueue, sampler: Optional[CallSiteSampler] = None) -> None:
+        super().__init__(queue)
+        self.sampler = sampler
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if self.sampler is not None and record.levelno >= logging.WARNING:
+            suppressed = self.sampler.sample(record)
+            if suppressed is None:
+                return False
+            if suppressed:
+                # the record is shared with other handlers it propagates to
+                record = copy.copy(record)
+                record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return super().handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+listeners: List[logging.handlers.QueueListener] = []
+
+
+def enable_queue_logging(burst: int = 10, interval: float = 60, sample_rate: int = 100):
+    """Moves the handlers of the root and all configured loggers onto background listeners.
+
+    Each logger gets its own queue so records keep their original routing.
+
+    :param burst: Warnings/errors let through per call site per interval, defaults to 10
+    :type burst: int, optional
+    :param interval: Length of a rate-limiting window in seconds, defaults to 60
+    :type interval: float, optional
+    :param sample_rate: Let 1 in this many warnings/errors through once the burst is spent, defaults to 100
+    :type sample_rate: int, optional
+    """
+    loggers = [logging.getLogger()] + [
+        logging.getLogger(name) for name in cfg.get('loggers', {}) if name != 'root'
+    ]
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+        q = queue.SimpleQueue()
+        handler = LazyQueueHandler(q, CallSiteSampler(burst, interval, sample_rate))
+        listener = logging.handlers.QueueListener(q, *logger.handlers, respect_handler_level=True)
+        logger.handlers = [handler]
+        listener.start()
+        listeners.append(listener)
+
+
+@atexit.register
+def stop_queue_logging():
+    """Flushes queued records and stops the listener threads."""
+    while listeners:
+        listeners.pop().stop()
+
+
+queue_cfg: dict = cfg.pop('queue', None) or {}
 logging.config.dictConfig(cfg)
+if queue_cfg.pop('enabled', False):
+    enable_queue_logging(**queue_cfg)
@@ -12,6 +12,8 @@ class Result:
 
     meme: Optional[m.Meme] = None
     is_db_ready: bool = False
+    # the meme is already stored, only its texts need loading
+    is_existing: bool = False
 
     def __init__(self, url: str) -> None:
         self.meme = m.Meme(url=url)
@@ -25,8 +27,8 @@ class Result:
     def set_meme_image(self, mimg: m.MemeImage):
         self.meme.image = mimg
     
-    def set_meme_image_from_args(self, width: int = None, height: int = None, channels: int = None, format: int = None):
-        self.meme.image = m.MemeImage(width=width, height=height, channels=channels, format=format)
+    def set_meme_image_from_args(self, width: int = None, height: int = None, channels: int = None, format: int = None, frame_count: int = None, duration: float = None):
+        self.meme.image = m.MemeImage(width=width, height=height, channels=channels, format=format, frame_count=frame_count, duration=duration)
 
     def add_meme_text(self, mtext: m.MemeText):
         self.meme.texts.append(mtext)
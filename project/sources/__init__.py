@@ -1,2 +1,4 @@
+from . import comments
+from . import dump
 from . import reddit
 from . import source
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Reddit comment ingestion.
+
+Fetches the top comments of many submissions concurrently through Reddit's OAuth API,
+sharing one rate limit across the workers. Only comments included in the listing
+response are used; "load more" stubs are skipped because expanding them costs an
+extra request each.
+
+`api_url` and `auth_url` can point at a local fake server for testing.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+
+from project.sources.reddit import USER_AGENT
+
+import requests
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+    from project.result import Result
+
+
+logger: Logger = logging.getLogger(__name__)
+
+REDDIT_API_URL = 'https://oauth.reddit.com'
+REDDIT_AUTH_URL = 'https://www.reddit.com/api/v1/access_token'
+# bodies left behind by deleted comments
+REMOVED_BODIES = {'[deleted]', '[removed]'}
+
+
+class RateLimiter:
+    """Spaces requests evenly to stay under a per-minute limit, shared across threads.
+
+    Also honors Reddit's `X-Ratelimit-*` headers when the remaining quota runs out.
+
+    :param requests_per_minute: Maximum requests per minute
+    :type requests_per_minute: float
+    """
+
+    def __init__(self, requests_per_minute: float) -> None:
+        self.interval = 60 / requests_per_minute
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the caller may send its next request."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+    def update(self, response: requests.Response):
+        """Pauses everyone until the quota resets if the response says it is spent.
+
+        :param response: Response carrying rate limit headers
+        :type response: requests.Response
+        """
+        remaining = response.headers.get('X-Ratelimit-Remaining')
+        reset = response.headers.get('X-Ratelimit-Reset') or response.headers.get('Retry-After')
+        if reset is not None and (response.status_code == 429 or (remaining is not None and float(remaining) < 1)):
+            with self._lock:
+                self._next = max(self._next, time.monotonic() + float(reset))
+
+
+def submission_id(post_url: str) -> str:
+    """Gets a submission's id from its shortlink, e.g. `https://redd.it/abc123`."""
+    return post_url.rstrip('/').rsplit('/', 1)[-1]
+
+
+class CommentFetcher:
+    """Fetches the top comments of submissions with a pool of workers.
+
+    :param limit: Maximum comments per submission, defaults to 10
+    :type limit: int, optional
+    :param depth: Maximum reply depth, 1 for top-level comments only, defaults to 1
+    :type depth: int, optional
+    :param requests_per_minute: Request budget shared by the workers, defaults to 60
+    :type requests_per_minute: float, optional
+    :param workers: Concurrent requests, defaults to 4
+    :type workers: int, optional
+    :param api_url: Base url of the OAuth API, defaults to `REDDIT_API_URL`
+    :type api_url: str, optional
+    :param auth_url: Url of the access token endpoint, defaults to `REDDIT_AUTH_URL`
+    :type auth_url: str, optional
+    :param retries: Attempts per submission after being rate limited, defaults to 3
+    :type retries: int, optional
+    """
+
+    def __init__(
+        self,
+        limit: int = 10,
+        depth: int = 1,
+        requests_per_minute: float = 60,
+        workers: int = 4,
+        api_url: str = REDDIT_API_URL,
+        auth_url: str = REDDIT_AUTH_URL,
+        retries: int = 3
+    ) -> None:
+        self.limit = limit
+        self.depth = depth
+        self.workers = workers
+        self.api_url = api_url.rstrip('/')
+        self.auth_url = auth_url
+        self.retries = retries
+        self.rate_limiter = RateLimiter(requests_per_minute)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+        self._token: Optional[str] = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+
+    def token(self) -> str:
+        """Gets an application-only access token, requesting a new one when it expires.
+
+        :return: Access token
+        :rtype: str
+        """
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expiry:
+                r = self.session.post(
+                    self.auth_url,
+                    auth=(os.getenv('REDDIT_ID'), os.getenv('REDDIT_SECRET')),
+                    data={'grant_type': 'client_credentials'}
+                )
+                r.raise_for_status()
+                body = r.json()
+                self._token = body['access_token']
+                # refresh a minute early
+                self._token_expiry = time.monotonic() + float(body.get('expires_in', 3600)) - 60
+            return self._token
+
+    def expire_token(self):
+        """Forgets the current access token so the next request gets a new one."""
+        with self._token_lock:
+            self._token = None
+
+    def collect(self, listing: dict) -> List[str]:
+        """Collects comment bodies from a comment listing, breadth first, within the depth
+        and count limits.
+
+        :param listing: Comment listing from the API
+        :type listing: dict
+        :return: Comment bodies, top-level comments first
+        :rtype: List[str]
+        """
+        bodies = []
+        queue = deque((child, 1) for child in listing['data']['children'])
+        while queue and len(bodies) < self.limit:
+            child, level = queue.popleft()
+            # 'more' stubs need their own request to expand
+            if child.get('kind') != 't1':
+                continue
+            data: dict = child['data']
+            body = data.get('body')
+            # stickied comments are moderator/bot notices rather than reactions
+            if body and body not in REMOVED_BODIES and not data.get('stickied'):
+                bodies.append(body)
+            replies = data.get('replies')
+            if replies and level < self.depth:
+                queue.extend((reply, level + 1) for reply in replies['data']['children'])
+        return bodies
+
+    def fetch(self, submission: str) -> List[str]:
+        """Fetches the top comments of a submission.
+
+        :param submission: Submission id
+        :type submission: str
+        :return: Comment bodies
+        :rtype: List[str]
+        """
+        refreshed = False
+        for _ in range(self.retries + 1):
+            self.rate_limiter.wait()
+            r = self.session.get(
+                f"{self.api_url}/comments/{submission}",
+                headers={'Authorization': f"bearer {self.token()}"},
+                params={'limit': self.limit, 'depth': self.depth, 'sort': 'top', 'raw_json': 1}
+            )
+            self.rate_limiter.update(r)
+            if r.status_code == 401 and not refreshed:
+                # the token was revoked or expired early, request a new one once
+                self.expire_token()
+                refreshed = True
+                continue
+            if r.status_code != 429:
+                break
+        r.raise_for_status()
+        # [submission listing, comment listing]
+        return self.collect(r.json()[1])
+
+    def _fetch_or_log(self, submission: str) -> List[str]:
+        try:
+            return self.fetch(submission)
+        except Exception:
+            logger.warning("Errored while fetching comments of %s", submission, exc_info=True)
+            return []
+
+    def fetch_many(self, submissions: Iterable[str]) -> Dict[str, List[str]]:
+        """Fetches the top comments of many submissions concurrently.
+
+        Submissions that fail are logged and map to an empty list.
+
+        :param submissions: Submission ids
+        :type submissions: Iterable[str]
+        :return: Comment bodies by submission id
+        :rtype: Dict[str, List[str]]
+        """
+        submissions = list(dict.fromkeys(submissions))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return dict(zip(submissions, pool.map(self._fetch_or_log, submissions)))
+
+
+def attach_comments(results: List[Result], fetcher: CommentFetcher) -> List[Result]:
+    """Adds the top comments of each result's Reddit post as `comment` texts.
+
+    :param results: Meme container objects
+    :type results: List[Result]
+    :param fetcher: Comment fetcher
+    :type fetcher: CommentFetcher
+    :return: The same results
+    :rtype: List[Result]
+    """
+    posts = {
+        id(r): submission_id(r.meme.context.post_url)
+        for r in results
+        if r.meme.context is not None and r.meme.context.origin == 'reddit'
+    }
+    comments = fetcher.fetch_many(posts.values())
+    for r in results:
+        for body in comments.get(posts.get(id(r)), ()):
+            r.add_meme_text_from_args(body, 'comment', 1.0)
+    return results
@@ -0,0 +1,200 @@
+"""
+Reddit dump file source implementation for historical backfills.
+
+"""
+from __future__ import annotations
+import bz2
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import IO, Generator, Iterable, List, Optional, Pattern, Tuple, TYPE_CHECKING, Union
+
+from project.result import Result
+from project.sources.source import Source
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+
+logger: Logger = logging.getLogger(__name__)
+
+# matches direct links to the image formats the vision transforms can handle
+IMAGE_URL_PATTERN = r'\.(?:gif|png|jpe?g|webm|tiff|bmp)$'
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+}
+
+
+def open_dump(path: str) -> IO[bytes]:
+    """Opens a dump file for binary reading, decompressing by file extension.
+
+    :param path: Path to a plain, gzip or bz2 newline-delimited JSON file
+    :type path: str
+    :return: Binary file object over the decompressed content
+    :rtype: IO[bytes]
+    """
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rb')
+
+
+def shard_offsets(path: str, shards: int) -> List[Tuple[int, Optional[int]]]:
+    """Splits a dump file into byte ranges of roughly equal size for parallel workers.
+
+    Ranges are in the file's decompressed byte space. They do not need to fall on line
+    boundaries; `RedditDumpSource` assigns every line to exactly one range.
+
+    Plain files are sized with `os.path.getsize`. Compressed files must be decompressed
+    once to measure, and every shard has to decompress up to its start offset,
+    so plain files are preferred for sharding. A single shard covers the whole file
+    without measuring it.
+
+    :param path: Path to the dump file
+    :type path: str
+    :param shards: Number of ranges to split into
+    :type shards: int
+    :return: `(start, end)` byte offsets, one per shard, `end` is None for the end of file
+    :rtype: List[Tuple[int, Optional[int]]]
+    """
+    if shards <= 1:
+        return [(0, None)]
+    if os.path.splitext(path)[1] in OPENERS:
+        size = 0
+        with open_dump(path) as fo:
+            for chunk in iter(lambda: fo.read(1 << 20), b''):
+                size += len(chunk)
+    else:
+        size = os.path.getsize(path)
+    step = -(-size // shards)
+    return [(i, min(i + step, size)) for i in range(0, size, step)] if size else [(0, 0)]
+
+
+def to_timestamp(value: Union[datetime, float, int, None]) -> Optional[float]:
+    """Normalizes a datetime or epoch seconds to epoch seconds."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return value
+
+
+class RedditDumpSource(Source):
+    """Streams submissions from newline-delimited JSON Reddit dump files.
+
+    Lines are read and parsed one at a time, so memory use does not grow with the size
+    of the dump.
+
+    :param paths: Dump file paths (plain, `.gz` or `.bz2`)
+    :type paths: Iterable[str]
+    :param subreddits: Subreddit names to keep (case-insensitive), defaults to memes
+    :type subreddits: Iterable[str], optional
+    :param after: Keep submissions created at or after this time, defaults to None
+    :type after: Union[datetime, float], optional
+    :param before: Keep submissions created before this time, defaults to None
+    :type before: Union[datetime, float], optional
+    :param url_pattern: Regular expression a submission's url must match, defaults to `IMAGE_URL_PATTERN`
+    :type url_pattern: Union[str, Pattern], optional
+    :param start: Byte offset to begin reading from, defaults to 0
+    :type start: int, optional
+    :param end: Byte offset to stop reading at, defaults to the end of file
+    :type end: int, optional
+    :param limit: Maximum number of results to yield, defaults to None
+    :type limit: int, optional
+
+    `start`/`end` apply to every path, so they are meant for sharding a single file with
+    `shard_offsets`. A line belongs to the shard its first byte falls within.
+    """
+
+    def __init__(
+        self,
+        paths: Iterable[str],
+        subreddits: Iterable[str] = ('memes',),
+        after: Union[datetime, float, None] = None,
+        before: Union[datetime, float, None] = None,
+        url_pattern: Union[str, Pattern] = IMAGE_URL_PATTERN,
+        start: int = 0,
+        end: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> None:
+        super().__init__()
+        self.paths: List[str] = [paths] if isinstance(paths, str) else list(paths)
+        self.subreddits = {s.lower() for s in subreddits} if subreddits else None
+        self._subreddit_needles = [f'"{s}"'.encode() for s in self.subreddits or ()]
+        self.after: Optional[float] = to_timestamp(after)
+        self.before: Optional[float] = to_timestamp(before)
+        self.url_pattern: Pattern = re.compile(url_pattern, re.IGNORECASE) if isinstance(url_pattern, str) else url_pattern
+        self.start: int = start
+        self.end: Optional[int] = end
+        self.limit: Optional[int] = limit
+
+    def lines(self, path: str) -> Generator[bytes]:
+        """Yields the raw lines of a dump file within this source's byte range.
+
+        :param path: Path to the dump file
+        :type path: str
+        :yield: Raw JSON line
+        :rtype: Generator[bytes]
+        """
+        with open_dump(path) as fo:
+            position = 0
+            if self.start > 0:
+                # back up one byte so a line starting exactly on `start` is kept;
+                # the partial line is owned by the previous shard
+                fo.seek(self.start - 1)
+                position = self.start - 1 + len(fo.readline())
+            while self.end is None or position < self.end:
+                line = fo.readline()
+                if not line:
+                    break
+                position += len(line)
+                yield line
+
+    def accept(self, submission: dict) -> bool:
+        """Checks a submission against the subreddit, time range and url filters.
+
+        :param submission: Parsed submission object from the dump
+        :type submission: dict
+        :return: The submission should be extracted
+        :rtype: bool
+        """
+        if self.subreddits is not None and str(submission.get('subreddit', '')).lower() not in self.subreddits:
+            return False
+        if submission.get('is_self'):
+            return False
+        created = float(submission.get('created_utc') or 0)
+        if self.after is not None and created < self.after:
+            return False
+        if self.before is not None and created >= self.before:
+            return False
+        url = submission.get('url')
+        return bool(url) and bool(submission.get('title')) and self.url_pattern.search(url) is not None
+
+    def extract(self) -> Generator[Result]:
+        yielded = 0
+        for path in self.paths:
+            for line in self.lines(path):
+                # cheap prefilter before paying for a full JSON parse
+                if self._subreddit_needles:
+                    lowered = line.lower()
+                    if not any(n in lowered for n in self._subreddit_needles):
+                        continue
+                try:
+                    submission: dict = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping malformed line in %s", path)
+                    continue
+                if not self.accept(submission):
+                    continue
+
+                r: Result = Result(submission['url'])
+                r.set_meme_context_from_args('reddit', f"https://redd.it/{submission['id']}")
+                r.add_meme_text_from_args(submission['title'], 'title', 1.0)
+                yield r
+
+                yielded += 1
+                if self.limit is not None and yielded >= self.limit:
+                    return
@@ -27,13 +27,15 @@ logger: Logger = logging.getLogger(__name__)
 logger.getChild("praw")
 logger.getChild("prawcore")
 
+USER_AGENT = "Mac OSX:membrain.data.project:v0.0.1 (by /u/dominictarro)"
+
 
 class RedditSource(Source, abc.ABC):
 
     reddit = praw.Reddit(
         client_id=os.getenv("REDDIT_ID"),
         client_secret=os.getenv("REDDIT_SECRET"),
-        user_agent="Mac OSX:membrain.data.project:v0.0.1 (by /u/dominictarro)",
+        user_agent=USER_AGENT,
     )
 
     def __init__(self, limit: int) -> None:
@@ -1 +1,2 @@
+from . import coalesce
 from . import language
\ No newline at end of file
@@ -1,6 +1,8 @@
 """
 Computer vision algorithms.
 """
+from typing import List
+
 import cv2
 import numpy as np
 
@@ -27,3 +29,179 @@ def perceptual_hash(img: np.ndarray, hash_size: int = 8) -> int:
     _img = cv2.resize(_img, (hash_size+1, hash_size))
     _img = _img[:, 1:] > _img[:, :-1]
     return sum([2 ** i for (i, v) in enumerate(_img.flatten()) if v])
+
+def thumbnail(img: np.ndarray, size: int) -> np.ndarray:
+    """Downscales an image so its longest side is at most `size`, keeping its aspect ratio.
+
+    :param img: Image to downscale
+    :type img: np.ndarray
+    :param size: Maximum length of the longest side in pixels
+    :type size: int
+    :return: Downscaled image, or the original if it is already small enough
+    :rtype: np.ndarray
+    """
+    scale = size / max(img.shape[:2])
+    if scale >= 1:
+        return img
+    return cv2.resize(
+        img,
+        (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))),
+        interpolation=cv2.INTER_AREA
+    )
+
+def is_informative(img: np.ndarray, min_std: float = 8.0) -> bool:
+    """Checks that an image is not a near-uniform frame (e.g. a black or blank fade).
+
+    :param img: BGR image
+    :type img: np.ndarray
+    :param min_std: Minimum grayscale standard deviation, defaults to 8.0
+    :type min_std: float, optional
+    :return: The image has enough contrast to be worth hashing
+    :rtype: bool
+    """
+    return float(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).std()) >= min_std
+
+def animated_perceptual_hash(frames: List[np.ndarray], hash_size: int = 8, keyframes: int = 5) -> int:
+    """Computes a perceptual hash of an animation from a sample of its frames.
+
+    Near-uniform frames are skipped, `keyframes` frames are sampled evenly from the rest
+    and each bit of the result is the majority vote of the sampled frames' hashes. The
+    result is the same size as `perceptual_hash` and comparable by Hamming distance.
+
+    :param frames: BGR frames in display order
+    :type frames: List[np.ndarray]
+    :param hash_size: Number of bytes the hash should be, defaults to 8
+    :type hash_size: int, optional
+    :param keyframes: Number of frames to sample, defaults to 5
+    :type keyframes: int, optional
+    :return: Animation hash
+    :rtype: int
+    """
+    candidates = [f for f in frames if is_informative(f)] or frames
+    indices = np.unique(np.linspace(0, len(candidates) - 1, num=min(keyframes, len(candidates))).round().astype(int))
+    hashes = [perceptual_hash(candidates[i], hash_size=hash_size) for i in indices]
+
+    bits = hash_size * hash_size
+    votes = np.array([[(h >> b) & 1 for b in range(bits)] for h in hashes]).sum(axis=0)
+    return sum(2 ** b for b in range(bits) if votes[b] * 2 > len(hashes))
+
+def to_bgr(img: np.ndarray) -> np.ndarray:
+    """Converts a grayscale, grayscale + alpha or BGRA image to 8-bit BGR."""
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    elif img.dtype.kind == 'f':
+        # float images are scaled to [0, 1]
+        img = np.clip(img * 255, 0, 255).astype(np.uint8)
+    elif img.dtype != np.uint8:
+        img = np.clip(img, 0, 255).astype(np.uint8)
+    if img.ndim == 3 and img.shape[2] == 2:
+        img = img[..., 0]
+    if img.ndim == 2 or img.shape[2] == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+def color_histograms(batch: np.ndarray, levels: int = 4) -> np.ndarray:
+    """Computes joint BGR color histograms of a batch of images.
+
+    :param batch: `(N, H, W, 3)` uint8 BGR images
+    :type batch: np.ndarray
+    :param levels: Quantization levels per channel, defaults to 4
+    :type levels: int, optional
+    :return: `(N, levels ** 3)` share of pixels in each color bin, bins indexed `b * levels ** 2 + g * levels + r`
+    :rtype: np.ndarray
+    """
+    n = batch.shape[0]
+    bins = levels ** 3
+    q = (batch // (256 // levels)).astype(np.int64)
+    index = q[..., 0] * levels ** 2 + q[..., 1] * levels + q[..., 2]
+    # offset each image into its own run of bins so one bincount covers the batch
+    index += (np.arange(n) * bins)[:, None, None]
+    counts = np.bincount(index.ravel(), minlength=n * bins).reshape(n, bins)
+    return counts / (batch.shape[1] * batch.shape[2])
+
+def dominant_colors(histograms: np.ndarray, k: int = 3, levels: int = 4) -> np.ndarray:
+    """Picks the centers of the most populated color bins.
+
+    :param histograms: `(N, levels ** 3)` color histograms from `color_histograms`
+    :type histograms: np.ndarray
+    :param k: Number of colors, defaults to 3
+    :type k: int, optional
+    :param levels: Quantization levels per channel, defaults to 4
+    :type levels: int, optional
+    :return: `(N, k, 3)` uint8 RGB colors, most dominant first
+    :rtype: np.ndarray
+    """
+    top = np.argsort(-histograms, axis=1, kind='stable')[:, :k]
+    # images with fewer than k colors repeat their most dominant one
+    top = np.where(np.take_along_axis(histograms, top, axis=1) > 0, top, top[:, :1])
+    step = 256 // levels
+    b, g, r = top // levels ** 2, top // levels % levels, top % levels
+    return (np.stack([r, g, b], axis=-1) * step + step // 2).astype(np.uint8)
+
+def laplacian_variance(gray: np.ndarray) -> np.ndarray:
+    """Computes the variance of the Laplacian of a batch of images, a sharpness score
+    that is low for blurry images.
+
+    :param gray: `(N, H, W)` grayscale images
+    :type gray: np.ndarray
+    :return: `(N,)` sharpness scores
+    :rtype: np.ndarray
+    """
+    g = gray.astype(np.float32)
+    lap = (
+        g[:, :-2, 1:-1] + g[:, 2:, 1:-1] + g[:, 1:-1, :-2] + g[:, 1:-1, 2:]
+        - 4 * g[:, 1:-1, 1:-1]
+    )
+    return lap.reshape(lap.shape[0], -1).var(axis=1)
+
+def text_likelihood(gray: np.ndarray, bands: int = 8, threshold: float = 64) -> np.ndarray:
+    """Scores how likely a batch of images is to have caption text.
+
+    Caption text forms horizontal bands dense with strong edges, so the score is the
+    edge density of the densest of `bands` horizontal bands.
+
+    :param gray: `(N, H, W)` grayscale images
+    :type gray: np.ndarray
+    :param bands: Number of horizontal bands, defaults to 8
+    :type bands: int, optional
+    :param threshold: Minimum gradient magnitude of an edge pixel, defaults to 64
+    :type threshold: float, optional
+    :return: `(N,)` scores in [0, 1]
+    :rtype: np.ndarray
+    """
+    g = gray.astype(np.float32)
+    gx = np.abs(g[:, 1:-1, 2:] - g[:, 1:-1, :-2])
+    gy = np.abs(g[:, 2:, 1:-1] - g[:, :-2, 1:-1])
+    edges = (gx + gy) > threshold
+    n, h, w = edges.shape
+    h -= h % bands
+    density = edges[:, :h].reshape(n, bands, h // bands, w).mean(axis=(2, 3))
+    return density.max(axis=1)
+
+def batch_image_features(images: List[np.ndarray], size: int = 192) -> dict:
+    """Computes color, sharpness and text features of a batch of images in one pass.
+
+    Images are resized to `size` x `size` and stacked so every feature is computed with
+    whole-batch array operations.
+
+    :param images: Images, ideally already reduced thumbnails
+    :type images: List[np.ndarray]
+    :param size: Side length images are resized to, defaults to 192
+    :type size: int, optional
+    :return: Arrays keyed `color_histogram` `(N, 64)`, `dominant_colors` `(N, 3, 3)`, `sharpness` `(N,)` and `text_score` `(N,)`
+    :rtype: dict
+    """
+    batch = np.stack([
+        cv2.resize(to_bgr(img), (size, size), interpolation=cv2.INTER_AREA)
+        for img in images
+    ])
+    gray = (batch @ np.array([0.114, 0.587, 0.299], dtype=np.float32))
+    histograms = color_histograms(batch)
+    return {
+        'color_histogram': histograms,
+        'dominant_colors': dominant_colors(histograms),
+        'sharpness': laplacian_variance(gray),
+        'text_score': text_likelihood(gray),
+    }
@@ -1,17 +1,18 @@
 """
 Utilities for reading and writing image data.
 """
+import io
 import logging
 import os
 from contextlib import contextmanager
-import traceback
-from typing import Iterator
+from typing import Iterator, Optional, Tuple
 
+import av
 import cv2
 import imageio
 import numpy as np
-from pyparsing import Optional
 import requests
+from PIL import Image, ImageSequence
 
 
 @contextmanager
@@ -33,7 +34,7 @@ def temporary_file_from_web(url: str, temp_dir: str = '.') -> Iterator[str]:
             fo.write(r.content)
         yield tfp
     except Exception:
-        logging.error(traceback.format_exc())
+        logging.error("Errored while reading temporary file %s", tfp, exc_info=True)
     finally:
         if os.path.isfile(tfp):
             os.remove(tfp)
@@ -49,7 +50,27 @@ def get_any_image(url: str) -> np.ndarray:
     """
     with temporary_file_from_web(url) as tfp:
         # GIFs will only load the first frame
-        return imageio.imread(tfp)
+        img = np.asarray(imageio.imread(tfp))
+    # imageio decodes to RGB(A), the rest of the pipeline expects OpenCV's BGR(A)
+    if img.ndim == 3 and img.shape[2] == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if img.ndim == 3 and img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2BGRA)
+    return img
+
+def get_first_video_frame(url: str) -> np.ndarray:
+    """Gets the first frame of a video from a url, downloading the whole file.
+
+    :param url: Url to the video
+    :type url: str
+    :return: BGR frame
+    :rtype: np.ndarray
+    """
+    r: requests.Response = requests.get(url)
+    r.raise_for_status()
+    with av.open(io.BytesIO(r.content)) as container:
+        frame = next(container.decode(container.streams.video[0]))
+        return frame.to_ndarray(format='bgr24')
 
 def get_static_image(url: str) -> np.ndarray:
     """Get an image from a url and read it from memory.
@@ -74,6 +95,141 @@ FORMAT_HANDLERS={
     '.tiff': get_any_image,
     '.bmp': get_static_image
 }
+
+# formats decoded frame by frame through `AnimatedImage`
+PILLOW_ANIMATED_FORMATS = {'.gif', '.webp'}
+VIDEO_FORMATS = {'.webm', '.mp4'}
+ANIMATED_FORMATS = PILLOW_ANIMATED_FORMATS | VIDEO_FORMATS
+# GIF frames without a delay are conventionally shown for 100ms
+DEFAULT_FRAME_DURATION = 0.1
+
+
+class TruncatedContainerError(Exception):
+    """The downloaded prefix of an animation cannot be opened, e.g. an MP4 whose index
+    is stored at the end of the file."""
+
+
+class AnimatedImage:
+    """An animated image held in memory and decoded one frame at a time.
+
+    `frame_count` and `duration` (seconds) are read from the container where it records
+    them. Otherwise they are filled in as frames are decoded: exactly if decoding reaches
+    the last frame, or extrapolated from the average frame duration if it stops early.
+    Both stay None if they cannot be determined, or if the file holds a single frame.
+
+    :param content: Encoded file content
+    :type content: bytes
+    :param fmt: File extension, including the dot
+    :type fmt: str
+    :param truncated: The content is only a prefix of the file, defaults to False
+    :type truncated: bool, optional
+    """
+
+    def __init__(self, content: bytes, fmt: str, truncated: bool = False) -> None:
+        self.content = content
+        self.fmt = fmt.lower()
+        self.truncated = truncated
+        self.frame_count: Optional[int] = None
+        self.duration: Optional[float] = None
+
+    def frames(self, max_frames: int, max_seconds: float) -> Iterator[Tuple[np.ndarray, float]]:
+        """Decodes frames until the end of the animation or the budget is spent.
+
+        :param max_frames: Maximum number of frames to decode
+        :type max_frames: int
+        :param max_seconds: Stop at the first frame shown at or after this time
+        :type max_seconds: float
+        :yield: BGR frame and the time it is shown at in seconds
+        :rtype: Iterator[Tuple[np.ndarray, float]]
+        """
+        reader = self._video_frames() if self.fmt in VIDEO_FORMATS else self._pillow_frames()
+        decoded = 0
+        last_timestamp = 0.0
+        try:
+            # checked before pulling a frame so the budget never decodes an extra one
+            while decoded < max_frames:
+                frame, timestamp = next(reader, (None, None))
+                if frame is None:
+                    # reached the last frame
+                    if self.frame_count is None and not self.truncated:
+                        self.frame_count = decoded
+                    return
+                if timestamp >= max_seconds:
+                    return
+                decoded += 1
+                last_timestamp = timestamp
+                yield frame, timestamp
+        finally:
+            reader.close()
+            if self.duration is None and decoded and self.frame_count:
+                interval = last_timestamp / (decoded - 1) if decoded > 1 else DEFAULT_FRAME_DURATION
+                self.duration = interval * self.frame_count
+            if self.frame_count == 1:
+                # a still image saved in an animated format
+                self.frame_count = self.duration = None
+
+    def _pillow_frames(self) -> Iterator[Tuple[np.ndarray, float]]:
+        with Image.open(io.BytesIO(self.content)) as im:
+            if not self.truncated:
+                # walks frame headers without decoding image data
+                self.frame_count = getattr(im, 'n_frames', 1)
+            timestamp = 0.0
+            try:
+                for frame in ImageSequence.Iterator(im):
+                    delay = frame.info.get('duration') or DEFAULT_FRAME_DURATION * 1000
+                    yield cv2.cvtColor(np.asarray(frame.convert('RGB')), cv2.COLOR_RGB2BGR), timestamp
+                    timestamp += delay / 1000
+            except (EOFError, OSError):
+                if not self.truncated:
+                    raise
+                return
+            self.duration = timestamp
+
+    def _video_frames(self) -> Iterator[Tuple[np.ndarray, float]]:
+        try:
+            container = av.open(io.BytesIO(self.content))
+        except av.error.FFmpegError as e:
+            if self.truncated:
+                raise TruncatedContainerError(f"Cannot open the first {len(self.content)} bytes of the {self.fmt} file") from e
+            raise
+        with container:
+            stream = container.streams.video[0]
+            if stream.frames:
+                self.frame_count = stream.frames
+            if container.duration:
+                self.duration = container.duration / av.time_base
+                if self.frame_count is None and stream.average_rate:
+                    self.frame_count = round(self.duration * stream.average_rate)
+            try:
+                for frame in container.decode(stream):
+                    yield frame.to_ndarray(format='bgr24'), float(frame.time or 0.0)
+            except av.error.FFmpegError:
+                if not self.truncated:
+                    raise
+
+
+def get_animation(url: str, max_bytes: int) -> AnimatedImage:
+    """Downloads an animated image into memory, reading at most `max_bytes`.
+
+    Frames are stored in order, so a prefix of the file is enough to decode the frames
+    within a sampling budget.
+
+    :param url: Url to the animated image
+    :type url: str
+    :param max_bytes: Maximum number of bytes to download
+    :type max_bytes: int
+    :return: Animated image
+    :rtype: AnimatedImage
+    """
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        buffer = bytearray()
+        for chunk in r.iter_content(chunk_size=1 << 16):
+            buffer += chunk
+            if len(buffer) >= max_bytes:
+                return AnimatedImage(bytes(buffer), os.path.splitext(url)[1], truncated=True)
+    return AnimatedImage(bytes(buffer), os.path.splitext(url)[1])
+
 def get_image(url: str) -> np.ndarray:
     """Gets a meme's image from its url.
 
@@ -0,0 +1,183 @@
+"""
+Coalesces results that refer to the same meme.
+"""
+from __future__ import annotations
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from project import models as m
+
+from sqlalchemy.sql import or_, select
+
+if TYPE_CHECKING:
+    from project.result import Result
+
+    from sqlalchemy.orm.session import Session as _Session
+
+logger = logging.getLogger(__name__)
+
+# (text_type, body) identifies a text within a meme
+TextKey = Tuple[str, str]
+
+
+def merge_texts(canonical: Result, texts: Iterable[m.MemeText], seen: Set[TextKey]):
+    """Moves texts onto the canonical result, skipping ones it already has.
+
+    :param canonical: Result the texts are attached to
+    :type canonical: Result
+    :param texts: Texts to attach
+    :type texts: Iterable[m.MemeText]
+    :param seen: Keys of the texts the canonical result already has, updated in place
+    :type seen: Set[TextKey]
+    """
+    for mtext in list(texts):
+        key = (mtext.text_type, mtext.body)
+        if key not in seen:
+            seen.add(key)
+            canonical.add_meme_text(mtext)
+
+def coalesce_by_url(results: List[Result]) -> List[Result]:
+    """Merges results that share a url, e.g. the same post listed by several sources.
+
+    Runs before images are fetched so each url is only downloaded once.
+
+    :param results: Meme container objects
+    :type results: List[Result]
+    :return: One result per url
+    :rtype: List[Result]
+    """
+    canonical: Dict[str, Result] = {}
+    seen: Dict[str, Set[TextKey]] = {}
+    for r in results:
+        c = canonical.setdefault(r.meme.url, r)
+        if c is r:
+            seen[r.meme.url] = {(t.text_type, t.body) for t in r.meme.texts}
+        else:
+            merge_texts(c, r.meme.texts, seen[r.meme.url])
+    return list(canonical.values())
+
+def stored_meme_ids(session: _Session, results: List[Result]) -> List[Optional[bytes]]:
+    """Finds the stored meme each result refers to.
+
+    A result matches a stored meme by image hash, by url or by post url, in that order of
+    precedence. The url and post url are unique too, so a result stored under a different
+    hash (e.g. its image changed) would otherwise fail to insert.
+
+    :param session: Database session
+    :type session: Session
+    :param results: Hashed meme container objects
+    :type results: List[Result]
+    :return: Id of the matching stored meme for each result, None if it is new
+    :rtype: List[Optional[bytes]]
+    """
+    ids = {r.meme.id for r in results}
+    urls = {r.meme.url for r in results if r.meme.url}
+    posts = {r.meme.context.post_url for r in results if r.meme.context is not None}
+
+    by_id: Set[bytes] = set()
+    by_url: Dict[str, bytes] = {}
+    for meme_id, url in session.execute(
+        select(m.Meme.id, m.Meme.url).where(or_(m.Meme.id.in_(ids), m.Meme.url.in_(urls)))
+    ):
+        if meme_id in ids:
+            by_id.add(meme_id)
+        if url in urls:
+            by_url[url] = meme_id
+    by_post: Dict[str, bytes] = dict(session.execute(
+        select(m.MemeContext.post_url, m.MemeContext.id).where(m.MemeContext.post_url.in_(posts))
+    )) if posts else {}
+
+    def match(r: Result) -> Optional[bytes]:
+        if r.meme.id in by_id:
+            return r.meme.id
+        if r.meme.url in by_url:
+            return by_url[r.meme.url]
+        if r.meme.context is not None:
+            return by_post.get(r.meme.context.post_url)
+        return None
+
+    return [match(r) for r in results]
+
+def stored_text_keys(session: _Session, meme_ids: Iterable[bytes]) -> Set[Tuple[bytes, str, str]]:
+    """Gets the `(meme_id, text_type, body)` of every text stored for the memes."""
+    meme_ids = list(meme_ids)
+    if not meme_ids:
+        return set()
+    return set(session.execute(
+        select(m.MemeText.meme_id, m.MemeText.text_type, m.MemeText.body)
+        .where(m.MemeText.meme_id.in_(meme_ids))
+    ))
+
+def attach_to_stored(r: Result, stored_id: bytes, stored_texts: Set[Tuple[bytes, str, str]]) -> bool:
+    """Points a result at a stored meme, keeping only the texts the stored meme lacks.
+
+    :param r: Meme container object
+    :type r: Result
+    :param stored_id: Id of the stored meme
+    :type stored_id: bytes
+    :param stored_texts: Keys from `stored_text_keys`
+    :type stored_texts: Set[Tuple[bytes, str, str]]
+    :return: The result still has texts to load
+    :rtype: bool
+    """
+    r.is_existing = True
+    r.meme.id = stored_id
+    r.meme.texts = [
+        t for t in r.meme.texts
+        if (stored_id, t.text_type, t.body) not in stored_texts
+    ]
+    return bool(r.meme.texts)
+
+def coalesce_by_hash(results: List[Result]) -> List[Result]:
+    """Merges hashed results that share an image hash within the batch, then against
+    memes already in the database.
+
+    The first result with a hash becomes canonical and the texts of the others are moved
+    onto it. Canonical results that match a stored meme by hash, url or post url (see
+    `stored_meme_ids`) are flagged `is_existing`, take the stored meme's id and keep only
+    texts it doesn't have, so the loader attaches them to the stored meme instead of
+    inserting a duplicate. Results left with nothing to load are dropped.
+
+    Run after `extract_image_features` and before language processing so that no text
+    is analyzed twice.
+
+    :param results: Meme container objects
+    :type results: List[Result]
+    :return: One result per unique meme with something to load
+    :rtype: List[Result]
+    """
+    canonical: Dict[bytes, Result] = {}
+    seen: Dict[bytes, Set[TextKey]] = {}
+    for r in filter(lambda r: r.is_db_ready, results):
+        c = canonical.setdefault(r.meme.id, r)
+        if c is r:
+            seen[r.meme.id] = {(t.text_type, t.body) for t in r.meme.texts}
+        else:
+            merge_texts(c, r.meme.texts, seen[r.meme.id])
+            logger.info("Coalesced %s into %s", r, c)
+    if not canonical:
+        return []
+
+    hashed = list(canonical.values())
+    with m.Session() as s:
+        s: _Session
+        stored_ids = stored_meme_ids(s, hashed)
+        stored = stored_text_keys(s, {i for i in stored_ids if i is not None})
+
+    # results with different hashes can match the same stored meme by url or post
+    by_stored: Dict[bytes, Result] = {}
+    coalesced = []
+    for r, stored_id in zip(hashed, stored_ids):
+        if stored_id is None:
+            coalesced.append(r)
+            continue
+        c = by_stored.get(stored_id)
+        if c is not None:
+            merge_texts(c, r.meme.texts, {(t.text_type, t.body) for t in c.meme.texts})
+            attach_to_stored(c, stored_id, stored)
+            continue
+        if attach_to_stored(r, stored_id, stored):
+            by_stored[stored_id] = r
+            coalesced.append(r)
+    logger.info("Coalesced %d results into %d (%d existing)", len(results), len(coalesced), len(by_stored))
+    return coalesced
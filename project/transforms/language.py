@@ -2,6 +2,7 @@
 Transforms raw text into linguistic components.
 """
 from __future__ import annotations
+from functools import lru_cache
 from typing import TYPE_CHECKING, List, Tuple
 
 from project import models as m
@@ -16,42 +17,94 @@ if TYPE_CHECKING:
 
 # some nltk functions use whole language name while others use abbreviations
 NLTK_LANG = 'eng', 'english'
-LANG_STOP_WORDS = stopwords.words(NLTK_LANG[1])
+LANG_STOP_WORDS = set(stopwords.words(NLTK_LANG[1]))
 LEMMATIZER = WordNetLemmatizer()
+# longest word/lemma MemeWord can store. Longer tokens are pasted links and the like
+MAX_WORD_LENGTH = min(m.MemeWord.__table__.c.word.type.length, m.MemeWord.__table__.c.lemma.type.length)
 
 
-def extract_word_features(result: Result, msentence: m.MemeSentence, pos_tags: List[str]):
-    """Extracts words and their features from sentences and adds them to the result object.
+# analyses of recently seen text bodies, so reposts and repeated titles are processed once
+ANALYSIS_CACHE_SIZE = 8192
+
+Word = Tuple[str, str, str]
+SentenceAnalysis = Tuple[str, Tuple[Word, ...], Tuple[str, ...]]
+
+
+def analyze_words(pos_tags: List[Tuple[str]]) -> Tuple[Word, ...]:
+    """Extracts words and their features from a tagged sentence.
+
+    :param pos_tags: Array of words w/ part-of-speech
+    :type pos_tags: List[Tuple[str]]
+    :return: `(word, pos_tag, lemma)` of each non-stop word that fits in `MAX_WORD_LENGTH`
+    :rtype: Tuple[Word, ...]
+    """
+    # Stop words are excluded from the MemeWord set
+    non_stop_word_tags = filter(lambda pos_tag: pos_tag[0] not in LANG_STOP_WORDS, pos_tags)
+    words = ((word, pos, LEMMATIZER.lemmatize(word)) for word, pos in non_stop_word_tags)
+    # an over-long token would fail the insert of the whole meme
+    return tuple(w for w in words if len(w[0]) <= MAX_WORD_LENGTH and len(w[2]) <= MAX_WORD_LENGTH)
+
+def analyze_chunks(pos_tags: List[Tuple[str]]) -> Tuple[str, ...]:
+    """Extracts named entity chunks from a tagged sentence.
+
+    :param pos_tags: Array of words w/ part-of-speech
+    :type pos_tags: List[Tuple[str]]
+    :return: Named entity chunks
+    :rtype: Tuple[str, ...]
+    """
+    return tuple(
+        ' '.join(i[0] for i in t)
+        for t in nltk.ne_chunk(pos_tags, binary=True)
+        if hasattr(t, 'label') and t.label() == 'NE'
+    )
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def analyze_text(body: str) -> Tuple[SentenceAnalysis, ...]:
+    """Splits a body of text into sentences and extracts their words and chunks.
+
+    Results are cached by body, so identical texts are only analyzed once.
+
+    :param body: Text to analyze
+    :type body: str
+    :return: `(sentence, words, chunks)` of each sentence
+    :rtype: Tuple[SentenceAnalysis, ...]
+    """
+    analysis = []
+    for sentence in sent_tokenize(body):
+        tokens: List[str] = word_tokenize(sentence)
+        pos_tags: List[Tuple[str]] = nltk.pos_tag(tokens, lang=NLTK_LANG[0])
+        analysis.append((sentence, analyze_words(pos_tags), analyze_chunks(pos_tags)))
+    return tuple(analysis)
+
+
+def extract_word_features(result: Result, msentence: m.MemeSentence, words: Tuple[Word, ...]):
+    """Adds a sentence's words and their features to the result object.
 
     :param result: Meme container object
     :type result: Result
-    :param msentence: Sentence to have word features extracted from
+    :param msentence: Sentence the words belong to
     :type msentence: m.MemeSentence
-    :param pos_tags: Array of words w/ part-of-speech
-    :type pos_tags: List[str]
+    :param words: `(word, pos_tag, lemma)` of each word
+    :type words: Tuple[Word, ...]
     """
-    # Stop words are excluded from the MemeWord set
-    non_stop_word_tags = list(filter(lambda pos_tag: pos_tag[0] not in LANG_STOP_WORDS, pos_tags))
-    for word, pos in non_stop_word_tags:
-        lemma = LEMMATIZER.lemmatize(word)
+    for word, pos, lemma in words:
         result.add_meme_word_from_args(msentence, word, pos, lemma)
 
-def extract_chunk_features(result: Result, msentence: m.MemeSentence, pos_tags: List[Tuple[str]]):
-    """Extracts chunks and their features from sentences and adds them to the result object.
+def extract_chunk_features(result: Result, msentence: m.MemeSentence, chunks: Tuple[str, ...]):
+    """Adds a sentence's chunks and their features to the result object.
 
     :param result: Meme container object
     :type result: Result
-    :param msentence: Sentence to have chunk features extracted from
+    :param msentence: Sentence the chunks belong to
     :type msentence: MemeSentence
-    :param pos_tags: Array of words w/ part-of-speech
-    :type pos_tags: List[Tuple[str]]
+    :param chunks: Named entity chunks
+    :type chunks: Tuple[str, ...]
 
     ## Extracted Features
         - Named Entity
     """
-    for t in nltk.ne_chunk(pos_tags, binary=True):
-        if hasattr(t, 'label') and t.label() == 'NE':
-            result.add_meme_chunk_from_args(msentence, chunk=' '.join(i[0] for i in t), is_named_entity=True)
+    for chunk in chunks:
+        result.add_meme_chunk_from_args(msentence, chunk=chunk, is_named_entity=True)
 
 def extract_sentence_features(result: Result, mtext: m.MemeText):
     """Extracts sentences and their features from text blocks and adds them to the result object.
@@ -61,16 +114,12 @@ def extract_sentence_features(result: Result, mtext: m.MemeText):
     :param mtext: Text to have sentence features extracted from
     :type mtext: m.MemeText
     """
-    tokens = sent_tokenize(mtext.body)
-    for sentence in tokens:
+    for sentence, words, chunks in analyze_text(mtext.body):
         msentence = m.MemeSentence(sentence=sentence)
         result.add_meme_sentence(mtext, msentence)
 
-        tokens: List[str] = word_tokenize(msentence.sentence)
-        pos_tags: List[Tuple[str]] = nltk.pos_tag(tokens, lang=NLTK_LANG[0])
-
-        extract_word_features(result, msentence, pos_tags)
-        extract_chunk_features(result, msentence, pos_tags)
+        extract_word_features(result, msentence, words)
+        extract_chunk_features(result, msentence, chunks)
 
 
 def extract_nltk_features(result: Result):
@@ -4,8 +4,7 @@ Transforms meme images into linguistic and visual features.
 from __future__ import annotations
 import logging
 import sys
-import traceback
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 from project.transforms._vision import image_io as iio
 from project.transforms._vision import algorithms as ialg
@@ -18,39 +17,140 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# per-file budget for animated images
+ANIMATION_MAX_FRAMES = int(os.getenv('ANIMATION_MAX_FRAMES', 120))
+ANIMATION_MAX_SECONDS = float(os.getenv('ANIMATION_MAX_SECONDS', 10))
+ANIMATION_MAX_BYTES = int(os.getenv('ANIMATION_MAX_BYTES', 16 * 2 ** 20))
+ANIMATION_KEYFRAMES = int(os.getenv('ANIMATION_KEYFRAMES', 5))
+# frames are downscaled to this size while sampling, hashing only needs a few pixels
+ANIMATION_SAMPLE_SIZE = 64
+# images are kept at this size after hashing for the batch features
+FEATURE_THUMBNAIL_SIZE = 256
 
 
-def extract_image_meta_features(result: Result, img: np.ndarray):
+def extract_image_meta_features(result: Result, img: np.ndarray, animation: Optional[iio.AnimatedImage] = None):
     init_kwargs = dict()
+    if animation is not None:
+        init_kwargs['frame_count'] = animation.frame_count
+        init_kwargs['duration'] = animation.duration
     # resolution
     try:
         init_kwargs['height'] = img.shape[0]
         init_kwargs['width'] = img.shape[1]
         init_kwargs['channels'] = img.shape[2] if len(img.shape) > 2 else 1
     except Exception:
-        logger.warning(f"Failed to set resolution \nid: {result}\n shape: {img.shape}\n {traceback.format_exc()}")
+        logger.warning("Failed to set resolution \nid: %s\n shape: %s", result, img.shape, exc_info=True)
 
     try:
         init_kwargs['format'] = os.path.splitext(result.meme.url)[-1]
     except Exception:
-        logger.warning(f"Failed to set format \nid: {result}\n shape: {img.shape}\n {traceback.format_exc()}")
+        logger.warning("Failed to set format \nid: %s\n shape: %s", result, img.shape, exc_info=True)
     result.set_meme_image_from_args(**init_kwargs)
 
-def extract_image_features(result: Result):
+def sample_animation(animation: iio.AnimatedImage) -> Tuple[np.ndarray, int]:
+    """Decodes an animation within the frame/time budget and hashes a sample of its frames.
+
+    Only downscaled copies of the decoded frames are kept, plus the first informative
+    frame at full resolution to represent the animation.
+
+    :param animation: Animated image
+    :type animation: iio.AnimatedImage
+    :return: Representative frame and the animation's hash
+    :rtype: Tuple[np.ndarray, int]
+    """
+    representative: Optional[np.ndarray] = None
+    samples = []
+    for frame, _ in animation.frames(ANIMATION_MAX_FRAMES, ANIMATION_MAX_SECONDS):
+        sample = ialg.thumbnail(frame, ANIMATION_SAMPLE_SIZE)
+        if representative is None and ialg.is_informative(sample):
+            representative = frame
+        samples.append(sample)
+    if not samples:
+        raise ValueError("Animation has no decodable frames")
+    if representative is None:
+        representative = frame
+    return representative, ialg.animated_perceptual_hash(samples, hash_size=8, keyframes=ANIMATION_KEYFRAMES)
+
+def extract_image_batch_features(results: List[Result], thumbnails: List[np.ndarray]):
+    """Computes color, sharpness and caption text features for a batch of results from
+    the thumbnails kept by `extract_image_features`, without decoding their images again.
+
+    :param results: Meme container objects with their image set
+    :type results: List[Result]
+    :param thumbnails: Thumbnail of each result's image
+    :type thumbnails: List[np.ndarray]
+    """
+    if not results:
+        return
     try:
-        img: np.ndarray = iio.get_image(result.meme.url)
+        set_image_batch_features(results, ialg.batch_image_features(thumbnails))
+        return
+    except Exception:
+        logger.warning("Errored while extracting batch image features, retrying per image", exc_info=True)
+
+    # one bad image shouldn't cost the rest of the batch their features
+    for r, thumbnail in zip(results, thumbnails):
+        try:
+            set_image_batch_features([r], ialg.batch_image_features([thumbnail]))
+        except Exception:
+            logger.warning("Errored while extracting image features  \nid: %s", r, exc_info=True)
+
+def set_image_batch_features(results: List[Result], features: dict):
+    """Stores the arrays from `batch_image_features` on each result's image.
+
+    :param results: Meme container objects with their image set
+    :type results: List[Result]
+    :param features: Feature arrays, one row per result
+    :type features: dict
+    """
+    histograms = np.rint(features['color_histogram'] * 255).astype(np.uint8)
+    for i, r in enumerate(results):
+        mimg = r.meme.image
+        mimg.color_histogram = histograms[i].tobytes()
+        mimg.dominant_colors = features['dominant_colors'][i].tobytes()
+        mimg.sharpness = float(features['sharpness'][i])
+        mimg.text_score = float(features['text_score'][i])
+
+def extract_image_features(result: Result) -> Optional[np.ndarray]:
+    """Gets a meme's image, sets its hash id and meta features.
+
+    :param result: Meme container object
+    :type result: Result
+    :return: 8-bit BGR thumbnail of the image for `extract_image_batch_features`, None if the result is not db ready or the thumbnail failed
+    :rtype: Optional[np.ndarray]
+    """
+    animation: Optional[iio.AnimatedImage] = None
+    try:
+        if os.path.splitext(result.meme.url)[1].lower() in iio.ANIMATED_FORMATS:
+            animation = iio.get_animation(result.meme.url, ANIMATION_MAX_BYTES)
+            try:
+                img, phash = sample_animation(animation)
+            except iio.TruncatedContainerError:
+                # the container needs bytes past the budget, settle for the first frame
+                logger.info("Animation too large to sample, using its first frame  \nid: %s", result)
+                animation = None
+                img, phash = iio.get_first_video_frame(result.meme.url), None
+        else:
+            img: np.ndarray = iio.get_image(result.meme.url)
+            phash = None
         result.is_db_ready = True
     except Exception:
-        logger.warning(f"Errored while getting the image  \nid: {result}\n {traceback.format_exc()}")
+        logger.warning("Errored while getting the image  \nid: %s", result, exc_info=True)
         result.is_db_ready = False
         return
     
     try:
-        result.meme.id = ialg.perceptual_hash(img, hash_size=8).to_bytes(8, sys.byteorder)
+        if phash is None:
+            phash = ialg.perceptual_hash(img, hash_size=8)
+        result.meme.id = phash.to_bytes(8, sys.byteorder)
     except Exception:
-        logger.warning(f"Errored while setting the hash id  \nid: {result}\n {traceback.format_exc()}")
+        logger.warning("Errored while setting the hash id  \nid: %s", result, exc_info=True)
         result.is_db_ready = False
         return
     
-    extract_image_meta_features(result, img)
-    return result
+    extract_image_meta_features(result, img, animation)
+    try:
+        return ialg.thumbnail(ialg.to_bgr(img), FEATURE_THUMBNAIL_SIZE)
+    except Exception:
+        logger.warning("Errored while taking the thumbnail  \nid: %s", result, exc_info=True)
+        return None